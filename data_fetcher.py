@@ -4,7 +4,7 @@
 """
 通达信选股公式转Python3.11实现
 分为两个模块：
-1. data_fetcher.py - 获取历史K线数据并保存为Excel
+1. data_fetcher.py - 获取历史K线数据并保存为Parquet
 2. stock_selector.py - 读取数据并执行选股逻辑
 """
 
@@ -13,14 +13,64 @@
 import akshare as ak
 import pandas as pd
 import os
+import pickle
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import time
 
 
-def get_stock_list():
+class RateLimiter:
+    """
+    令牌桶限速器（线程安全）：限制每 time_period 秒内最多 max_rate 次请求
+
+    多线程并发下载时共享一个实例，替代原来每次请求后的固定sleep
+    """
+
+    def __init__(self, max_rate=20, time_period=1.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._lock = threading.Lock()
+        self._timestamps = deque()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # 清理窗口外的旧时间戳
+                while self._timestamps and now - self._timestamps[0] >= self.time_period:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.max_rate:
+                    self._timestamps.append(now)
+                    return
+                wait = self.time_period - (now - self._timestamps[0])
+            time.sleep(max(wait, 0.01))
+
+
+# 全部下载线程共享的限速器
+_rate_limiter = RateLimiter(max_rate=20, time_period=1.0)
+
+
+def get_stock_list(cache_path="cache/stock_list.pkl", cache_ttl=86400):
     """
     获取A股所有股票代码列表
+
+    参数:
+        cache_path: 列表缓存文件路径
+        cache_ttl: 缓存有效期（秒），默认1天（列表日内基本不变，
+                   避免每次运行都下载整张行情表）
     """
+    # 优先读磁盘缓存
+    if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < cache_ttl:
+        try:
+            with open(cache_path, 'rb') as f:
+                stock_list = pickle.load(f)
+            print(f"使用缓存的股票列表: {len(stock_list)} 只")
+            return stock_list
+        except Exception as e:
+            print(f"读取股票列表缓存失败（{e}），重新下载")
+
     try:
         # 获取东方财富A股列表
         stock_df = ak.stock_zh_a_spot()
@@ -38,6 +88,13 @@ def get_stock_list():
         stock_list = stock_df['代码'].tolist()
         print(f"过滤后剩余: {len(stock_list)} 只")
 
+        # 写入磁盘缓存供下次运行复用（空列表不缓存，避免上游偶发
+        # 返回异常数据后污染之后24小时的所有运行）
+        if stock_list:
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump(stock_list, f)
+
         return stock_list
     except Exception as e:
         print(f"获取股票列表失败: {e}")
@@ -46,7 +103,7 @@ def get_stock_list():
 
 def fetch_single_stock_data(stock_code, start_date, end_date, data_dir="data"):
     """
-    获取单只股票的历史日K线数据并保存为Excel
+    获取单只股票的历史日K线数据并保存为Parquet
 
     参数:
         stock_code: 股票代码，如 "000001"
@@ -55,55 +112,48 @@ def fetch_single_stock_data(stock_code, start_date, end_date, data_dir="data"):
         data_dir: 数据保存目录
     """
     try:
-        # 确保数据目录存在
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-            print(f"创建目录: {data_dir}")
+        # 确保数据目录存在（多线程并发调用，exist_ok避免先查后建的竞态）
+        os.makedirs(data_dir, exist_ok=True)
 
         # 检查文件是否已存在（避免重复下载）
-        file_path = os.path.join(data_dir, f"{stock_code}.xlsx")
+        file_path = os.path.join(data_dir, f"{stock_code}.parquet")
         if os.path.exists(file_path):
             print(f"股票 {stock_code} 数据已存在，跳过下载")
             return True
 
         # 使用akshare获取历史数据（前复权）
         # 注意：akshare的stock_zh_a_hist接口不需要sh/sz前缀
-        df = ak.stock_zh_a_daily(
-            symbol=stock_code,
-            start_date=start_date,
-            end_date=end_date,
-            adjust="qfq"  # 前复权
-        )
+        # 失败时指数退避重试（网络抖动/限流常见）
+        df = None
+        for attempt in range(3):
+            _rate_limiter.acquire()
+            try:
+                df = ak.stock_zh_a_daily(
+                    symbol=stock_code,
+                    start_date=start_date,
+                    end_date=end_date,
+                    adjust="qfq"  # 前复权
+                )
+                break
+            except Exception as e:
+                if attempt == 2:
+                    raise
+                backoff = 2 ** attempt
+                print(f"股票 {stock_code} 请求失败（{e}），{backoff}秒后重试")
+                time.sleep(backoff)
 
         if df.empty:
             print(f"股票 {stock_code} 无数据")
             return False
 
-        # 重命名列名为英文（便于后续处理）
-        column_mapping = {
-            '日期': 'date',
-            '开盘': 'open',
-            '最高': 'high',
-            '最低': 'low',
-            '收盘': 'close',
-            '成交量': 'volume',
-            '成交额': 'amount',
-            '换手率': 'turnover_rate'
-        }
-        df.rename(columns=column_mapping, inplace=True)
-
-        # 确保日期格式正确
-        df['date'] = pd.to_datetime(df['date'])
-
+        # stock_zh_a_daily已返回英文列名（date/open/high/low/close/volume/amount）
+        # 且date已是日期类型，无需重命名和转换
         # 按日期排序（升序，旧数据在前）
         df = df.sort_values('date').reset_index(drop=True)
 
-        # 保存为Excel
-        df.to_excel(file_path, index=False, engine='openpyxl')
+        # 保存为Parquet（列式存储，读写远快于Excel且文件更小）
+        df.to_parquet(file_path, engine='pyarrow', compression='zstd')
         print(f"股票 {stock_code} 数据已保存: {file_path} (共 {len(df)} 条记录)")
-
-        # 添加延迟，避免请求过快
-        time.sleep(0.5)
         return True
 
     except Exception as e:
@@ -136,16 +186,26 @@ def batch_fetch_data(start_date=None, end_date=None, data_dir="data", max_stocks
         stock_list = stock_list[:max_stocks]
         print(f"限制获取前 {max_stocks} 只股票（测试模式）")
 
-    # 批量下载
+    # 批量下载：下载是网络IO密集型，用线程池并发，限速器控制请求频率
     success_count = 0
     fail_count = 0
 
-    for i, stock_code in enumerate(stock_list, 1):
-        print(f"\n[{i}/{len(stock_list)}] 正在处理: {stock_code}")
-        if fetch_single_stock_data(stock_code, start_date, end_date, data_dir):
-            success_count += 1
-        else:
-            fail_count += 1
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = {
+            pool.submit(fetch_single_stock_data, code, start_date, end_date, data_dir): code
+            for code in stock_list
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            stock_code = futures[future]
+            print(f"\n[{i}/{len(stock_list)}] 处理完成: {stock_code}")
+            try:
+                if future.result():
+                    success_count += 1
+                else:
+                    fail_count += 1
+            except Exception as e:
+                print(f"股票 {stock_code} 下载失败: {e}")
+                fail_count += 1
 
     print(f"\n{'=' * 50}")
     print(f"数据获取完成！成功: {success_count}, 失败: {fail_count}")
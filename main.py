@@ -5,7 +5,7 @@
 """
 通达信选股公式转Python3.11实现
 分为两个模块：
-1. data_fetcher.py - 获取历史K线数据并保存为Excel
+1. data_fetcher.py - 获取历史K线数据并保存为Parquet
 2. stock_selector.py - 读取数据并执行选股逻辑
 """
 from data_fetcher import batch_fetch_data
@@ -4,18 +4,221 @@
 """
 通达信选股公式转Python3.11实现
 分为两个模块：
-1. data_fetcher.py - 获取历史K线数据并保存为Excel
+1. data_fetcher.py - 获取历史K线数据并保存为Parquet
 2. stock_selector.py - 读取数据并执行选股逻辑
 """
 # ==================== 模块2：选股模块 (stock_selector.py) ====================
 
+import akshare as ak
+import numba
 import numpy as np
 import pandas as pd
+import functools
+import json
+import multiprocessing as mp
 import os
-import glob
+import time
 from datetime import datetime
 
 
+@functools.lru_cache(maxsize=1)
+def _spot_table():
+    """
+    获取全市场实时行情表（东方财富spot接口）
+
+    整张表约5000行，一次下载数MB，进程内缓存一份，
+    所有需要实时行情/流通市值的调用方都走这里，避免重复下载
+    """
+    return ak.stock_zh_a_spot_em()
+
+
+@numba.njit(cache=True)
+def _sma_kernel(arr, n, m):
+    """
+    SMA递推核心：纯NumPy数组上的紧凑循环，由Numba编译为原生代码
+
+    递推公式无法用cumsum向量化，只能逐元素计算，
+    编译后避免了pandas逐元素索引的解释器开销
+
+    输入的NaN只会出现在序列开头（滚动窗口未满的前缀），
+    先跳过NaN前缀，之后的热循环不再做逐元素isnan判断
+
+    注意不能加fastmath=True：它允许编译器假定无NaN（nnan），
+    会把前缀扫描的isnan判断直接编译掉，NaN前缀输入将返回全NaN
+    """
+    size = arr.shape[0]
+    out = np.empty_like(arr)
+    start = 0
+    while start < size and np.isnan(arr[start]):
+        out[start] = np.nan
+        start += 1
+    if start < size:
+        out[start] = arr[start]
+        for i in range(start + 1, size):
+            out[i] = (m * arr[i] + (n - m) * out[i - 1]) / n
+    return out
+
+
+@numba.njit(cache=True)
+def _kdj_kernel(high, low, close):
+    """
+    KDJ核心计算：9日RSV + K/D的SMA递推 + J，单次编译执行
+
+    RSV前8个为NaN（9日窗口未满），DEN=0时RSV取50，与原pandas实现一致
+    """
+    n = close.shape[0]
+    rsv = np.full(n, np.nan)
+    for i in range(8, n):
+        lo = low[i - 8]
+        hi = high[i - 8]
+        for k in range(i - 7, i + 1):
+            if low[k] < lo:
+                lo = low[k]
+            if high[k] > hi:
+                hi = high[k]
+        den = hi - lo
+        if den == 0:
+            rsv[i] = 50.0
+        else:
+            rsv[i] = (close[i] - lo) / den * 100.0
+    k_line = _sma_kernel(rsv, 3, 1)
+    d_line = _sma_kernel(k_line, 3, 1)
+    j_line = 3 * k_line - 2 * d_line
+    return k_line, d_line, j_line
+
+
+@numba.njit(cache=True, fastmath=True)
+def _ema_kernel(arr, span):
+    """指数移动平均递推，等价于ewm(span=span, adjust=False).mean()"""
+    alpha = 2.0 / (span + 1.0)
+    out = np.empty_like(arr)
+    out[0] = arr[0]
+    for i in range(1, arr.shape[0]):
+        out[i] = alpha * arr[i] + (1.0 - alpha) * out[i - 1]
+    return out
+
+
+@numba.njit(cache=True, fastmath=True)
+def _indicator_kernel(high, low, close, open_, vol, amount):
+    """
+    选股所需全部数值指标的单遍融合计算
+
+    一次for循环同时推进：KDJ（9日窗口+K/D递推）、MACD（EMA递推）、
+    28/40日窗口的最高/最低/均值、前移40日均量。整条序列只从内存流过一次，
+    替代原来十几次独立的滚动遍历；窗口极小（<=40），直接重扫窗口即可。
+
+    返回: (k, d, j, dif, dea, o85, maxvol28, avg40, v40p, r55, a28raw)
+    其中a28raw为28日均成交额（未除亿元）
+    """
+    n = close.shape[0]
+    k_line = np.full(n, np.nan)
+    d_line = np.full(n, np.nan)
+    j_line = np.full(n, np.nan)
+    dif = np.empty(n)
+    dea = np.empty(n)
+    o85 = np.full(n, np.nan)
+    maxvol28 = np.full(n, np.nan)
+    avg40 = np.full(n, np.nan)
+    v40p = np.full(n, np.nan)
+    r55 = np.full(n, np.nan)
+    a28raw = np.full(n, np.nan)
+
+    alpha12 = 2.0 / 13.0
+    alpha26 = 2.0 / 27.0
+    alpha9 = 2.0 / 10.0
+    ema12 = close[0]
+    ema26 = close[0]
+    dea_state = 0.0
+    k_state = 0.0
+    d_state = 0.0
+    amount28_sum = 0.0
+    vol40_sum = 0.0
+    volp40_sum = 0.0
+
+    for i in range(n):
+        # ---- MACD：EMA递推 ----
+        if i > 0:
+            ema12 = alpha12 * close[i] + (1.0 - alpha12) * ema12
+            ema26 = alpha26 * close[i] + (1.0 - alpha26) * ema26
+        dif[i] = ema12 - ema26
+        if i == 0:
+            dea_state = dif[0]
+        else:
+            dea_state = alpha9 * dif[i] + (1.0 - alpha9) * dea_state
+        dea[i] = dea_state
+
+        # ---- 滑动累加和（进窗口加、出窗口减）----
+        amount28_sum += amount[i]
+        vol40_sum += vol[i]
+        if i >= 28:
+            amount28_sum -= amount[i - 28]
+        if i >= 40:
+            vol40_sum -= vol[i - 40]
+        if i >= 27:
+            a28raw[i] = amount28_sum / 28.0
+        if i >= 39:
+            avg40[i] = vol40_sum / 40.0
+        # V40P：昨日起的40日均量，即vol[i-40..i-1]的均值
+        if i >= 1:
+            volp40_sum += vol[i - 1]
+        if i >= 41:
+            volp40_sum -= vol[i - 41]
+        if i >= 40:
+            v40p[i] = volp40_sum / 40.0
+
+        # ---- KDJ：9日RSV + K/D的SMA(3,1)递推 ----
+        if i >= 8:
+            lo = low[i - 8]
+            hi = high[i - 8]
+            for t in range(i - 7, i + 1):
+                if low[t] < lo:
+                    lo = low[t]
+                if high[t] > hi:
+                    hi = high[t]
+            den = hi - lo
+            if den == 0:
+                rsv = 50.0
+            else:
+                rsv = (close[i] - lo) / den * 100.0
+            if i == 8:
+                k_state = rsv
+                d_state = k_state
+            else:
+                k_state = (rsv + 2.0 * k_state) / 3.0
+                d_state = (k_state + 2.0 * d_state) / 3.0
+            k_line[i] = k_state
+            d_line[i] = d_state
+            j_line[i] = 3.0 * k_state - 2.0 * d_state
+
+        # ---- 28日窗口：开盘价区间与天量 ----
+        if i >= 27:
+            o_lo = open_[i - 27]
+            o_hi = open_[i - 27]
+            v_hi = vol[i - 27]
+            for t in range(i - 26, i + 1):
+                if open_[t] < o_lo:
+                    o_lo = open_[t]
+                if open_[t] > o_hi:
+                    o_hi = open_[t]
+                if vol[t] > v_hi:
+                    v_hi = vol[t]
+            o85[i] = o_lo + 0.925 * (o_hi - o_lo)
+            maxvol28[i] = v_hi
+
+        # ---- 40日窗口：收盘价区间 ----
+        if i >= 39:
+            c_lo = close[i - 39]
+            c_hi = close[i - 39]
+            for t in range(i - 38, i + 1):
+                if close[t] < c_lo:
+                    c_lo = close[t]
+                if close[t] > c_hi:
+                    c_hi = close[t]
+            r55[i] = c_lo + 0.55 * (c_hi - c_lo)
+
+    return k_line, d_line, j_line, dif, dea, o85, maxvol28, avg40, v40p, r55, a28raw
+
+
 def sma(series, n, m):
     """
     计算SMA（平滑移动平均），通达信公式中的SMA
@@ -28,40 +231,51 @@ def sma(series, n, m):
         n: 周期
         m: 权重
     """
-    result = pd.Series(index=series.index, dtype=float)
-    result.iloc[0] = series.iloc[0]  # 初始值
+    arr = series.to_numpy(dtype=np.float64)
+    out = _sma_kernel(arr, n, m)
+    # 核函数返回的缓冲区直接包装成Series，不再复制一份
+    return pd.Series(out, index=series.index, copy=False)
 
-    for i in range(1, len(series)):
-        if pd.isna(result.iloc[i - 1]):
-            result.iloc[i] = series.iloc[i]
-        else:
-            result.iloc[i] = (m * series.iloc[i] + (n - m) * result.iloc[i - 1]) / n
-
-    return result
 
+def _windowed_sum(arr, window):
+    """
+    滚动窗口求和的cumsum差分实现，等价于rolling(window).sum()
 
-def calculate_kdj(df):
+    前缀和只扫描一次数组，三个窗口共享同一份前缀和即可差分得出，
+    避免pandas rolling对每个窗口重复扫描并生成临时数组
     """
-    计算KDJ指标
+    cs = np.concatenate(([0.0], np.cumsum(arr, dtype=np.float64)))
+    out = np.full(arr.shape[0], np.nan)
+    out[window - 1:] = cs[window:] - cs[:-window]
+    return out
+
+
+def _windowed_count(mask, window):
     """
-    # RSV: (收盘价-9日最低)/(9日最高-9日最低)*100
-    low_9 = df['low'].rolling(window=9).min()
-    high_9 = df['high'].rolling(window=9).max()
-    den = high_9 - low_9
+    布尔序列的滚动计数，等价于rolling(window).sum()后的整数计数
 
-    # 处理DEN=0的情况，设为50
-    rsv = pd.Series(50, index=df.index)
-    mask = den != 0
-    rsv[mask] = (df['close'][mask] - low_9[mask]) / den[mask] * 100
+    uint8视图上做一次前缀和再差分，O(N)完成；
+    前window-1个位置窗口未满，置为-1，使==0和>=1的比较都为False
+    （与pandas里NaN参与比较的行为一致）
+    """
+    cs = np.concatenate(([0], np.cumsum(np.asarray(mask, dtype=np.uint8), dtype=np.int32)))
+    out = np.full(len(mask), -1, dtype=np.int32)
+    out[window - 1:] = cs[window:] - cs[:-window]
+    return out
 
-    # K: RSV的3日SMA，权重1
-    k = sma(rsv, 3, 1)
-    # D: K的3日SMA，权重1
-    d = sma(k, 3, 1)
-    # J: 3K-2D
-    j = 3 * k - 2 * d
 
-    return k, d, j
+def calculate_kdj(df):
+    """
+    计算KDJ指标
+    """
+    k, d, j = _kdj_kernel(
+        df['high'].to_numpy(dtype=np.float64),
+        df['low'].to_numpy(dtype=np.float64),
+        df['close'].to_numpy(dtype=np.float64),
+    )
+    return (pd.Series(k, index=df.index, copy=False),
+            pd.Series(d, index=df.index, copy=False),
+            pd.Series(j, index=df.index, copy=False))
 
 
 def calculate_macd(df, fast=12, slow=26, signal=9):
@@ -69,12 +283,13 @@ def calculate_macd(df, fast=12, slow=26, signal=9):
     计算MACD指标
     返回: dif, dea, macd
     """
-    ema_fast = df['close'].ewm(span=fast, adjust=False).mean()
-    ema_slow = df['close'].ewm(span=slow, adjust=False).mean()
-    dif = ema_fast - ema_slow
-    dea = dif.ewm(span=signal, adjust=False).mean()
+    close = df['close'].to_numpy(dtype=np.float64)
+    dif = _ema_kernel(close, fast) - _ema_kernel(close, slow)
+    dea = _ema_kernel(dif, signal)
     macd = (dif - dea) * 2
-    return dif, dea, macd
+    return (pd.Series(dif, index=df.index, copy=False),
+            pd.Series(dea, index=df.index, copy=False),
+            pd.Series(macd, index=df.index, copy=False))
 
 
 def analyze_stock(df):
@@ -93,53 +308,69 @@ def analyze_stock(df):
     # 确保数据按日期排序（升序）
     df = df.sort_values('date').reset_index(drop=True)
 
-    # 计算必要指标
-    # H, L, C, O, VOL 对应 high, low, close, open, volume
-    df['H'] = df['high']
-    df['L'] = df['low']
-    df['C'] = df['close']
-    df['O'] = df['open']
-    df['VOL'] = df['volume']
-    df['AMOUNT'] = df['amount'] if 'amount' in df.columns else df['volume'] * df['close']
-
-    # 计算REF（前一日数据）
-    df['REF_C_1'] = df['C'].shift(1)
-
-    # ==================== KDJ计算 ====================
-    k, d, j = calculate_kdj(df)
-    df['K'] = k
-    df['D'] = d
-    df['J'] = j
+    # 数值计算用的原始数组（Numba核函数只接受NumPy数组）
+    # 直接取原始列，不再另存H/L/C/O/VOL别名列
+    high_arr = df['high'].to_numpy(dtype=np.float64)
+    low_arr = df['low'].to_numpy(dtype=np.float64)
+    open_arr = df['open'].to_numpy(dtype=np.float64)
+    close_arr = df['close'].to_numpy(dtype=np.float64)
+    vol_arr = df['volume'].to_numpy(dtype=np.float64)
+    if 'amount' in df.columns:
+        amount_arr = df['amount'].to_numpy(dtype=np.float64)
+    else:
+        amount_arr = vol_arr * close_arr
+
+    # REF（前一日数据）：默认RangeIndex下shift(1)就是数组后移一位
+    # 只计算一次并复用，避免多处shift(1)各自重新分配Series
+    close_ref1 = np.empty_like(close_arr)
+    close_ref1[0] = np.nan
+    close_ref1[1:] = close_arr[:-1]
+    vol_ref1 = np.empty_like(vol_arr)
+    vol_ref1[0] = np.nan
+    vol_ref1[1:] = vol_arr[:-1]
+
+    # ==================== 数值指标：单遍融合计算 ====================
+    (k_arr, d_arr, j_arr, dif_arr, dea_arr, o85_arr, maxvol28,
+     avg40_arr, v40p_arr, r55_arr, a28raw) = _indicator_kernel(
+        high_arr, low_arr, close_arr, open_arr, vol_arr, amount_arr)
+
+    # ==================== KDJ ====================
+    df['K'] = k_arr
+    df['D'] = d_arr
+    df['J'] = j_arr
     j_ok = df['J'] <= 13  # J_OK: J<=13
 
     # ==================== 真假阴阳线 ====================
+    # 纯布尔数组，只作中间量使用，不回写DataFrame列
     # REAL_YANG: C>O AND NOT(C<REF(C,1))  - 真阳线（收涨且不低于昨日收盘）
-    real_yang = (df['C'] > df['O']) & ~(df['C'] < df['REF_C_1'])
+    real_yang = (close_arr > open_arr) & ~(close_arr < close_ref1)
     # REAL_YIN: C<O AND NOT(C>REF(C,1))   - 真阴线（收跌且不高于昨日收盘）
-    real_yin = (df['C'] < df['O']) & ~(df['C'] > df['REF_C_1'])
+    real_yin = (close_arr < open_arr) & ~(close_arr > close_ref1)
     # FAKE_YANG: NOT(C<REF(C,1))          - 假阳线（不低于昨日收盘，包含平收和上涨）
-    fake_yang = ~(df['C'] < df['REF_C_1'])
+    fake_yang = ~(close_arr < close_ref1)
     # FAKE_YIN: NOT(C>REF(C,1))           - 假阴线（不高于昨日收盘，包含平收和下跌）
-    fake_yin = ~(df['C'] > df['REF_C_1'])
-
-    df['REAL_YANG'] = real_yang
-    df['REAL_YIN'] = real_yin
-    df['FAKE_YANG'] = fake_yang
-    df['FAKE_YIN'] = fake_yin
+    fake_yin = ~(close_arr > close_ref1)
 
     # ==================== 成交量统计 ====================
     # VOL*REAL_YANG 等，然后SUM
-    df['VOL_YANG21'] = (df['VOL'] * df['REAL_YANG']).rolling(window=21).sum()
-    df['VOL_YIN21'] = (df['VOL'] * df['REAL_YIN']).rolling(window=21).sum()
-    df['VOL_YANG14'] = (df['VOL'] * df['REAL_YANG']).rolling(window=14).sum()
-    df['VOL_YIN14'] = (df['VOL'] * df['REAL_YIN']).rolling(window=14).sum()
-
-    df['VOL_FAKEYANG21'] = (df['VOL'] * df['FAKE_YANG']).rolling(window=21).sum()
-    df['VOL_FAKEYIN21'] = (df['VOL'] * df['FAKE_YIN']).rolling(window=21).sum()
-    df['VOL_FAKEYANG14'] = (df['VOL'] * df['FAKE_YANG']).rolling(window=14).sum()
-    df['VOL_FAKEYIN14'] = (df['VOL'] * df['FAKE_YIN']).rolling(window=14).sum()
-    df['VOL_FAKEYANG10'] = (df['VOL'] * df['FAKE_YANG']).rolling(window=10).sum()
-    df['VOL_FAKEYIN10'] = (df['VOL'] * df['FAKE_YIN']).rolling(window=10).sum()
+    # 布尔数组上用where做无分支选择（免去bool->float乘法的临时提升），
+    # 每个选择结果只算一次，各窗口和用前缀和差分得出
+    vol_yang = np.where(real_yang, vol_arr, 0.0)
+    vol_yin = np.where(real_yin, vol_arr, 0.0)
+    vol_fakeyang = np.where(fake_yang, vol_arr, 0.0)
+    vol_fakeyin = np.where(fake_yin, vol_arr, 0.0)
+
+    df['VOL_YANG21'] = _windowed_sum(vol_yang, 21)
+    df['VOL_YIN21'] = _windowed_sum(vol_yin, 21)
+    df['VOL_YANG14'] = _windowed_sum(vol_yang, 14)
+    df['VOL_YIN14'] = _windowed_sum(vol_yin, 14)
+
+    df['VOL_FAKEYANG21'] = _windowed_sum(vol_fakeyang, 21)
+    df['VOL_FAKEYIN21'] = _windowed_sum(vol_fakeyin, 21)
+    df['VOL_FAKEYANG14'] = _windowed_sum(vol_fakeyang, 14)
+    df['VOL_FAKEYIN14'] = _windowed_sum(vol_fakeyin, 14)
+    df['VOL_FAKEYANG10'] = _windowed_sum(vol_fakeyang, 10)
+    df['VOL_FAKEYIN10'] = _windowed_sum(vol_fakeyin, 10)
 
     # YANGYIN_OK: 阳线量能显著大于阴线量能
     yangyin_ok = (
@@ -153,8 +384,9 @@ def analyze_stock(df):
 
     # ==================== 流动性与市值 ====================
     # A28:=MA(AMOUNT,28)/100000000;  28日均成交额（亿元）
-    df['A28'] = df['AMOUNT'].rolling(window=28).mean() / 100000000
-    lq = df['A28'] >= 0.005  # 大于5千万
+    a28 = a28raw / 100000000
+    df['A28'] = a28
+    lq = a28 >= 0.005  # 大于5千万
 
     # MV:=C*CAPITAL*100/100000000;  流通市值（亿元）
     # 注意：CAPITAL在通达信中是流通股本（股），这里用最新数据估算
@@ -167,51 +399,45 @@ def analyze_stock(df):
 
     # ==================== 价格形态条件 ====================
     # O85:=LLV(O,28)+0.925*(HHV(O,28)-LLV(O,28));  开盘价28日区间的92.5%位置
-    llv_o_28 = df['O'].rolling(window=28).min()
-    hhv_o_28 = df['O'].rolling(window=28).max()
-    df['O85'] = llv_o_28 + 0.925 * (hhv_o_28 - llv_o_28)
-    top15o = df['O'] >= df['O85']  # 开盘价在高位
+    df['O85'] = o85_arr
+    top15o = open_arr >= o85_arr  # 开盘价在高位
 
     # FD15:=C<REF(C,1) AND C<=O AND VOL>=1.15*REF(VOL,1);  下跌且放量
-    fd15 = (df['C'] < df['REF_C_1']) & (df['C'] <= df['O']) & (df['VOL'] >= 1.15 * df['VOL'].shift(1))
+    fd15 = (close_arr < close_ref1) & (close_arr <= open_arr) & (vol_arr >= 1.15 * vol_ref1)
 
     # GOOD28:=COUNT(TOP15O AND FD15,28)=0;  28日内无跳空高开且放量下跌
-    good28 = ((top15o & fd15).rolling(window=28).sum() == 0)
+    good28 = _windowed_count(top15o & fd15, 28) == 0
 
     # MAXVOL28:=HHV(VOL,28);
-    maxvol28 = df['VOL'].rolling(window=28).max()
     # MAX28_OK:=COUNT(VOL=MAXVOL28 AND REAL_YIN,28)=0;  28日无天量阴线
-    max28_ok = (((df['VOL'] == maxvol28) & df['REAL_YIN']).rolling(window=28).sum() == 0)
+    max28_ok = _windowed_count((vol_arr == maxvol28) & real_yin, 28) == 0
 
     # ==================== 倍量柱条件 ====================
     # AVG40:=MA(VOL,40);
-    df['AVG40'] = df['VOL'].rolling(window=40).mean()
+    df['AVG40'] = avg40_arr
     # PLRY:=VOL>1.8*REF(VOL,1) AND C>O AND VOL>AVG40;  倍量柱
-    plry = (df['VOL'] > 1.8 * df['VOL'].shift(1)) & (df['C'] > df['O']) & (df['VOL'] > df['AVG40'])
+    plry = (vol_arr > 1.8 * vol_ref1) & (close_arr > open_arr) & (vol_arr > avg40_arr)
     # PLRY_CNT:=COUNT(PLRY,28)>=1;  28日内有倍量柱
-    plry_cnt = plry.rolling(window=28).sum() >= 1
+    plry_cnt = _windowed_count(plry, 28) >= 1
 
     # ==================== 关键K条件 ====================
     # V40P:=SUM(REF(VOL,1),40)/40;  昨日开始的40日均量
-    df['V40P'] = df['VOL'].shift(1).rolling(window=40).mean()
+    df['V40P'] = v40p_arr
     # BD:=C>REF(C,1) AND C>=O;  上涨且收阳或平
-    bd = (df['C'] > df['REF_C_1']) & (df['C'] >= df['O'])
+    bd = (close_arr > close_ref1) & (close_arr >= open_arr)
     # BIGV:=VOL>1.75*V40P;  成交量大于40日均量75%
-    bigv = df['VOL'] > 1.75 * df['V40P']
+    bigv = vol_arr > 1.75 * v40p_arr
     # R55:=LLV(C,40)+0.55*(HHV(C,40)-LLV(C,40));  价格40日区间的55%位置
-    llv_c_40 = df['C'].rolling(window=40).min()
-    hhv_c_40 = df['C'].rolling(window=40).max()
-    df['R55'] = llv_c_40 + 0.55 * (hhv_c_40 - llv_c_40)
-    posok = df['C'] > df['R55']  # 价格在相对高位
+    df['R55'] = r55_arr
+    posok = close_arr > r55_arr  # 价格在相对高位
 
     # TRIGGER:= PLRY_CNT OR (BD AND BIGV AND POSOK);  触发条件
     trigger = plry_cnt | (bd & bigv & posok)
 
     # ==================== MACD条件 ====================
-    dif, dea, macd = calculate_macd(df)
-    df['DIF'] = dif
-    df['DEA'] = dea
-    macd_ok = dif > 0  # MACD.DIF>0
+    df['DIF'] = dif_arr
+    df['DEA'] = dea_arr
+    macd_ok = dif_arr > 0  # MACD.DIF>0
 
     # ==================== 最终选股条件 ====================
     # XG:= J_OK AND TRIGGER AND LQ AND MVOK AND MAX28_OK AND YANGYIN_OK AND MACD.DIF>0;
@@ -230,131 +456,464 @@ def analyze_stock(df):
         'indicators': {
             'J': latest['J'],
             'J_OK': latest['XG'] if not pd.isna(latest['J']) else False,
-            'TRIGGER': trigger.iloc[-1],
-            'LQ': lq.iloc[-1],
-            'MAX28_OK': max28_ok.iloc[-1],
+            'TRIGGER': trigger[-1],
+            'LQ': lq[-1],
+            'MAX28_OK': max28_ok[-1],
             'YANGYIN_OK': yangyin_ok.iloc[-1],
             'MACD_DIF': latest['DIF'],
-            'DIF>0': macd_ok.iloc[-1] if not pd.isna(latest['DIF']) else False
+            'DIF>0': macd_ok[-1] if not pd.isna(latest['DIF']) else False
         },
         'raw_data': latest
     }
 
 
-def get_circulating_market_cap(stock_code):
+def analyze_stocks_batch(frames):
     """
-    从实时行情获取流通市值（亿元）
+    批量张量化选股：把全部股票堆叠成 (N股票, T交易日, 6字段) 的float32张量
+
+    所有滚动指标在时间轴上用sliding_window_view一次性向量化计算；
+    递推类指标（KDJ的K/D、MACD的EMA）沿时间轴循环、跨全部股票向量化，
+    循环次数只与交易日数有关，与股票数无关。消除了逐股票的Python开销，
+    适用于全部数据能放进内存的场景（5000股×500日×6字段×4字节约60MB）。
+
+    短历史股票在头部用NaN填充，每只股票最后一根K线对齐在张量末列，
+    选股判定只取末列。注意复合指标的有效回看可能远超单个窗口：
+    末列的plry_cnt（28日计数）需要滞后27日的plry，其avg40又读到
+    67日前的成交量，max28_ok同理读到55日前——60日历史的股票这些
+    窗口确实会触及NaN填充区。与逐股票分析仍然一致，是因为触及NaN
+    的窗口归约得NaN、比较得False，与逐股票路径里"窗口未满"产生的
+    NaN/False完全相同；若要加长窗口或降低60日门槛，依赖的是这条
+    NaN传播语义，而不是填充区留有余量。
+
+    参数:
+        frames: {stock_code: DataFrame}，各DataFrame需包含
+                date/open/high/low/close/volume列（amount可选）
+
+    返回:
+        {stock_code: 精简结果dict}（与_process_one同构，不含市值检查；
+        数据不足60天的股票不在返回中）
     """
-    try:
-        # 使用akshare获取实时行情
-        spot_df = ak.stock_zh_a_spot_em()
-        stock_info = spot_df[spot_df['代码'] == stock_code]
-        if not stock_info.empty:
-            # 流通市值字段，单位亿元
-            return float(stock_info['流通市值'].values[0]) / 100000000  # 转换为亿元
+    codes = []
+    mats = []
+    last_rows = []
+    for code, df in frames.items():
+        if len(df) < 60:  # 需要至少60天的数据计算40日指标
+            continue
+        df = df.sort_values('date')
+        o = df['open'].to_numpy(dtype=np.float32)
+        h = df['high'].to_numpy(dtype=np.float32)
+        l = df['low'].to_numpy(dtype=np.float32)
+        c = df['close'].to_numpy(dtype=np.float32)
+        v = df['volume'].to_numpy(dtype=np.float32)
+        if 'amount' in df.columns:
+            a = df['amount'].to_numpy(dtype=np.float32)
+        else:
+            a = v * c
+        codes.append(code)
+        mats.append(np.stack((o, h, l, c, v, a), axis=1))
+        last = df.iloc[-1]
+        last_rows.append((str(last['date']), float(last['close']), float(last['volume'])))
+
+    if not codes:
+        return {}
+
+    # 头部NaN填充，末根K线对齐在末列
+    t_max = max(m.shape[0] for m in mats)
+    tensor = np.full((len(codes), t_max, 6), np.nan, dtype=np.float32)
+    for idx, m in enumerate(mats):
+        tensor[idx, t_max - m.shape[0]:, :] = m
+
+    O = tensor[:, :, 0]
+    H = tensor[:, :, 1]
+    L = tensor[:, :, 2]
+    C = tensor[:, :, 3]
+    V = tensor[:, :, 4]
+    A = tensor[:, :, 5]
+
+    swv = np.lib.stride_tricks.sliding_window_view
+
+    def _roll(x, window, reduce):
+        """时间轴上的滚动归约；窗口未满或触及NaN填充的位置为NaN"""
+        out = np.full_like(x, np.nan)
+        out[:, window - 1:] = reduce(swv(x, window, axis=1), axis=-1)
+        return out
+
+    def _rec_sma31(x):
+        """SMA(X,3,1)递推，跨股票向量化；前值NaN时以当前值起步"""
+        out = np.empty_like(x)
+        prev = x[:, 0].copy()
+        out[:, 0] = prev
+        for t in range(1, x.shape[1]):
+            cur = x[:, t]
+            prev = np.where(np.isnan(prev), cur, (cur + 2.0 * prev) / 3.0)
+            out[:, t] = prev
+        return out
+
+    def _rec_ema(x, span):
+        """EMA递推，跨股票向量化；前值NaN时以当前值起步"""
+        alpha = np.float32(2.0 / (span + 1.0))
+        out = np.empty_like(x)
+        prev = x[:, 0].copy()
+        out[:, 0] = prev
+        for t in range(1, x.shape[1]):
+            cur = x[:, t]
+            prev = np.where(np.isnan(prev), cur, alpha * cur + (1.0 - alpha) * prev)
+            out[:, t] = prev
+        return out
+
+    # REF（前一日数据）
+    c_ref1 = np.full_like(C, np.nan)
+    c_ref1[:, 1:] = C[:, :-1]
+    v_ref1 = np.full_like(V, np.nan)
+    v_ref1[:, 1:] = V[:, :-1]
+
+    # KDJ
+    low9 = _roll(L, 9, np.min)
+    high9 = _roll(H, 9, np.max)
+    den = high9 - low9
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rsv = (C - low9) / den * 100.0
+    rsv[den == 0] = 50.0
+    k_line = _rec_sma31(rsv)
+    d_line = _rec_sma31(k_line)
+    j_line = 3.0 * k_line - 2.0 * d_line
+
+    # MACD（选股只用到DIF）
+    dif = _rec_ema(C, 12) - _rec_ema(C, 26)
+    macd_ok = dif > 0
+
+    # 真假阴阳线与量能统计
+    real_yang = (C > O) & ~(C < c_ref1)
+    real_yin = (C < O) & ~(C > c_ref1)
+    fake_yang = ~(C < c_ref1)
+    fake_yin = ~(C > c_ref1)
+
+    vol_yang = np.where(real_yang, V, np.float32(0.0))
+    vol_yin = np.where(real_yin, V, np.float32(0.0))
+    vol_fakeyang = np.where(fake_yang, V, np.float32(0.0))
+    vol_fakeyin = np.where(fake_yin, V, np.float32(0.0))
+
+    yangyin_ok = (
+            (_roll(vol_yang, 21, np.sum) > 1.5 * _roll(vol_yin, 21, np.sum)) |
+            (_roll(vol_yang, 14, np.sum) > 1.5 * _roll(vol_yin, 14, np.sum)) |
+            (_roll(vol_fakeyang, 21, np.sum) > 1.5 * _roll(vol_fakeyin, 21, np.sum)) |
+            (_roll(vol_fakeyang, 14, np.sum) > 1.5 * _roll(vol_fakeyin, 14, np.sum)) |
+            (_roll(vol_fakeyang, 10, np.sum) > 1.8 * _roll(vol_fakeyin, 10, np.sum))
+    )
+
+    # 流动性
+    a28 = _roll(A, 28, np.mean) / 100000000
+    lq = a28 >= 0.005
+
+    # 价格形态
+    llv_o_28 = _roll(O, 28, np.min)
+    hhv_o_28 = _roll(O, 28, np.max)
+    o85 = llv_o_28 + 0.925 * (hhv_o_28 - llv_o_28)
+    maxvol28 = _roll(V, 28, np.max)
+    max28_ok = _roll(((V == maxvol28) & real_yin).astype(np.float32), 28, np.sum) == 0
+
+    # 倍量柱与关键K
+    avg40 = _roll(V, 40, np.mean)
+    plry = (V > 1.8 * v_ref1) & (C > O) & (V > avg40)
+    plry_cnt = _roll(plry.astype(np.float32), 28, np.sum) >= 1
+    v40p = _roll(v_ref1, 40, np.mean)
+    bd = (C > c_ref1) & (C >= O)
+    bigv = V > 1.75 * v40p
+    llv_c_40 = _roll(C, 40, np.min)
+    hhv_c_40 = _roll(C, 40, np.max)
+    r55 = llv_c_40 + 0.55 * (hhv_c_40 - llv_c_40)
+    posok = C > r55
+    trigger = plry_cnt | (bd & bigv & posok)
+
+    # 最终选股条件（市值MVOK由调用方用spot数据检查）
+    xg = (j_line <= 13) & trigger & lq & max28_ok & yangyin_ok & macd_ok
+
+    # 只取每只股票最后一根K线的判定结果
+    results = {}
+    for idx, code in enumerate(codes):
+        date_s, close_v, volume_v = last_rows[idx]
+        j_last = float(j_line[idx, -1])
+        dif_last = float(dif[idx, -1])
+        xg_last = bool(xg[idx, -1])
+        results[code] = {
+            'date': date_s,
+            'stock_code': code,
+            'selected': xg_last,
+            'indicators': {
+                'J': _json_value(j_last),
+                'J_OK': xg_last if not np.isnan(j_last) else False,
+                'TRIGGER': bool(trigger[idx, -1]),
+                'LQ': bool(lq[idx, -1]),
+                'MAX28_OK': bool(max28_ok[idx, -1]),
+                'YANGYIN_OK': bool(yangyin_ok[idx, -1]),
+                'MACD_DIF': _json_value(dif_last),
+                'DIF>0': bool(macd_ok[idx, -1]) if not np.isnan(dif_last) else False,
+            },
+            'raw_data': {'close': close_v, 'volume': volume_v},
+        }
+    return results
+
+
+# 子进程内共享的流通市值表与上次运行的结果缓存
+# （由_init_worker在进程启动时设置一次，避免每个任务重复pickle）
+_spot_dict = {}
+_results_cache = {}
+
+
+def _init_worker(spot_dict, results_cache):
+    """进程池worker初始化：接收一次流通市值表和结果缓存"""
+    global _spot_dict, _results_cache
+    _spot_dict = spot_dict
+    _results_cache = results_cache
+
+
+def _json_value(v):
+    """把numpy标量转成可JSON序列化的Python原生类型（NaN转为None）"""
+    if v is None:
         return None
-    except:
+    if isinstance(v, (bool, np.bool_)):
+        return bool(v)
+    if pd.isna(v):
         return None
+    return float(v)
+
+
+def _read_stock_file(file_path):
+    """
+    读取单只股票历史数据（Parquet为主，兼容旧的Excel缓存）
+
+    calamine引擎（Rust实现）读xlsx比openpyxl快数倍且省内存；
+    Parquet只投影分析用到的列，未用列（如turnover）的IO直接跳过
+    """
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path, columns=[
+            'date', 'open', 'high', 'low', 'close', 'volume', 'amount'])
+    return pd.read_excel(file_path, engine='calamine')
+
+
+def _missing_columns(df):
+    """返回缺少的必要列列表"""
+    required_cols = ['date', 'open', 'close', 'high', 'low', 'volume']
+    return [col for col in required_cols if col not in df.columns]
+
+
+def _apply_mv_check(result, spot_dict):
+    """检查流通市值条件（30亿以上），不达标则取消选中"""
+    stock_code = result['stock_code']
+    if stock_code in spot_dict:
+        mv = spot_dict[stock_code]
+        result['indicators']['MV'] = mv
+        result['indicators']['MVOK'] = mv >= 30
+        # 如果市值不足30亿，不选中
+        if mv < 30:
+            result['selected'] = False
+    else:
+        result['indicators']['MV'] = None
+        result['indicators']['MVOK'] = True  # 无法获取时默认通过
+
+
+def _process_one(file_path):
+    """
+    进程池任务：读取单只股票数据并执行选股分析
+
+    返回dict，固定包含stock_code；数据异常时带skipped/error字段
+    """
+    stock_code = os.path.splitext(os.path.basename(file_path))[0]
+    try:
+        mtime = os.path.getmtime(file_path)
+
+        # 数据文件自上次分析后未变化时直接复用缓存结果，不再读取和计算
+        cached = _results_cache.get(stock_code)
+        if cached is not None and cached.get('mtime') == mtime:
+            result = dict(cached['analysis'])
+            result['stock_code'] = stock_code
+            result['indicators'] = dict(result['indicators'])
+            result['cache_entry'] = cached
+        else:
+            df = _read_stock_file(file_path)
+
+            # 检查必要列是否存在
+            missing_cols = _missing_columns(df)
+            if missing_cols:
+                return {'stock_code': stock_code, 'skipped': f"缺少列 {missing_cols}"}
+
+            # 分析股票
+            raw = analyze_stock(df)
+            if raw is None:
+                return {'stock_code': stock_code, 'skipped': "数据不足"}
+
+            # 转成可JSON序列化的精简结果（便于磁盘缓存与进程间传递）
+            latest = raw['raw_data']
+            result = {
+                'date': str(raw['date']),
+                'stock_code': stock_code,
+                'selected': bool(raw['selected']),
+                'indicators': {k: _json_value(v) for k, v in raw['indicators'].items()},
+                'raw_data': {'close': float(latest['close']),
+                             'volume': float(latest['volume'])},
+            }
+            # 缓存市值检查前的分析结果（市值每次运行用最新spot数据判断）
+            result['cache_entry'] = {
+                'mtime': mtime,
+                'analysis': {
+                    'date': result['date'],
+                    'selected': result['selected'],
+                    'indicators': dict(result['indicators']),
+                    'raw_data': dict(result['raw_data']),
+                },
+            }
+
+        _apply_mv_check(result, _spot_dict)
+        return result
+
+    except Exception as e:
+        return {'stock_code': stock_code, 'error': str(e)}
 
 
-def run_stock_selection(data_dir="data", output_file="selected_stocks.xlsx"):
+def run_stock_selection(data_dir="data", output_file="selected_stocks.xlsx", batch=False):
     """
     执行选股操作
 
     参数:
         data_dir: 历史数据存放目录
         output_file: 选股结果输出文件
+        batch: True时用张量化批量分析（一次性加载全部数据做向量化计算，
+               不使用mtime结果缓存）；False时用进程池逐股票分析
     """
     # 检查数据目录是否存在
     if not os.path.exists(data_dir):
         print(f"错误：数据目录 {data_dir} 不存在！请先运行数据获取模块。")
         return
 
-    # 获取所有Excel文件
-    excel_files = glob.glob(os.path.join(data_dir, "*.xlsx"))
-    if not excel_files:
-        print(f"错误：在 {data_dir} 中没有找到Excel文件！请先运行数据获取模块。")
+    # 获取所有数据文件（Parquet为主，兼容旧的Excel缓存）
+    # os.scandir的DirEntry自带文件名和类型信息，省去glob对每个文件的stat调用
+    data_files = [entry.path for entry in os.scandir(data_dir)
+                  if entry.is_file() and entry.name.endswith(('.parquet', '.xlsx'))]
+    if not data_files:
+        print(f"错误：在 {data_dir} 中没有找到数据文件！请先运行数据获取模块。")
         return
 
-    print(f"找到 {len(excel_files)} 只股票数据文件")
+    print(f"找到 {len(data_files)} 只股票数据文件")
     print("开始选股分析...")
 
     selected_stocks = []
     failed_stocks = []
 
     # 获取实时流通市值数据（用于MVOK条件）
+    # spot表持久化为Parquet，5分钟内的快照直接复用，省去重复下载
     print("正在获取实时流通市值数据...")
+    spot_cache = os.path.join("cache", "spot.parquet")
     try:
-        spot_df = ak.stock_zh_a_spot_em()
+        if os.path.exists(spot_cache) and time.time() - os.path.getmtime(spot_cache) < 300:
+            spot_df = pd.read_parquet(spot_cache)
+        else:
+            spot_df = _spot_table()
+            os.makedirs(os.path.dirname(spot_cache), exist_ok=True)
+            spot_df.to_parquet(spot_cache)
         spot_df['流通市值亿'] = spot_df['流通市值'] / 100000000
         spot_dict = spot_df.set_index('代码')['流通市值亿'].to_dict()
     except:
         print("获取实时市值数据失败，将跳过市值筛选")
         spot_dict = {}
 
-    for i, file_path in enumerate(excel_files, 1):
-        stock_code = os.path.basename(file_path).replace('.xlsx', '')
-        print(f"\n[{i}/{len(excel_files)}] 分析股票: {stock_code}")
-
+    # 上次运行的结果缓存（按文件mtime判断是否需要重新分析）
+    results_cache_path = os.path.join("cache", "results.json")
+    results_cache = {}
+    if os.path.exists(results_cache_path):
         try:
-            # 读取Excel数据
-            df = pd.read_excel(file_path, engine='openpyxl')
+            with open(results_cache_path, 'r', encoding='utf-8') as f:
+                results_cache = json.load(f)
+        except Exception as e:
+            print(f"读取结果缓存失败（{e}），将全量重新分析")
 
-            # 检查必要列是否存在
-            required_cols = ['date', 'open', 'close', 'high', 'low', 'volume']
-            missing_cols = [col for col in required_cols if col not in df.columns]
-            if missing_cols:
-                print(f"  跳过：缺少列 {missing_cols}")
-                continue
+    def handle_result(i, result):
+        """汇总单只股票的分析结果并打印进度"""
+        stock_code = result['stock_code']
+        print(f"\n[{i}/{len(data_files)}] 分析股票: {stock_code}")
 
-            # 分析股票
-            result = analyze_stock(df)
-            if result is None:
-                print(f"  跳过：数据不足")
-                continue
+        # 回收缓存条目，运行结束后统一写盘
+        cache_entry = result.pop('cache_entry', None)
+        if cache_entry is not None:
+            results_cache[stock_code] = cache_entry
 
-            result['stock_code'] = stock_code
+        if 'skipped' in result:
+            print(f"  跳过：{result['skipped']}")
+            return
 
-            # 检查流通市值条件（30亿以上）
-            if stock_code in spot_dict:
-                mv = spot_dict[stock_code]
-                result['indicators']['MV'] = mv
-                result['indicators']['MVOK'] = mv >= 30
-                # 如果市值不足30亿，不选中
-                if mv < 30:
-                    result['selected'] = False
-            else:
-                result['indicators']['MV'] = None
-                result['indicators']['MVOK'] = True  # 无法获取时默认通过
-
-            if result['selected']:
-                print(f"  *** 选中！ ***")
-                print(f"      J值: {result['indicators']['J']:.2f}")
-                print(f"      MACD DIF: {result['indicators']['MACD_DIF']:.4f}")
-                selected_stocks.append(result)
+        if 'error' in result:
+            print(f"  错误: {result['error']}")
+            failed_stocks.append(stock_code)
+            return
+
+        if result['selected']:
+            print(f"  *** 选中！ ***")
+            print(f"      J值: {result['indicators']['J']:.2f}")
+            print(f"      MACD DIF: {result['indicators']['MACD_DIF']:.4f}")
+            selected_stocks.append(result)
+        else:
+            print(f"  未选中")
+            # 打印未选中的原因
+            ind = result['indicators']
+            reasons = []
+            if not ind.get('J_OK'): reasons.append(f"J>{13}")
+            if not ind.get('TRIGGER'): reasons.append("无触发信号")
+            if not ind.get('LQ'): reasons.append("流动性不足")
+            if not ind.get('MAX28_OK'): reasons.append("28日有天量阴线")
+            if not ind.get('YANGYIN_OK'): reasons.append("阴阳量不平衡")
+            if not ind.get('DIF>0'): reasons.append("MACD.DIF<=0")
+            if not ind.get('MVOK', True): reasons.append(f"市值{ind.get('MV', 0):.0f}亿<30亿")
+            if reasons:
+                print(f"      原因: {', '.join(reasons)}")
+
+    if batch:
+        # 批量模式：加载全部数据堆成张量，一次性向量化分析
+        print("批量模式：加载全部数据...")
+        frames = {}
+        results = []
+        for file_path in data_files:
+            stock_code = os.path.splitext(os.path.basename(file_path))[0]
+            try:
+                df = _read_stock_file(file_path)
+                missing_cols = _missing_columns(df)
+                if missing_cols:
+                    results.append({'stock_code': stock_code,
+                                    'skipped': f"缺少列 {missing_cols}"})
+                else:
+                    frames[stock_code] = df
+            except Exception as e:
+                results.append({'stock_code': stock_code, 'error': str(e)})
+
+        batch_results = analyze_stocks_batch(frames)
+        for stock_code in frames:
+            result = batch_results.get(stock_code)
+            if result is None:
+                results.append({'stock_code': stock_code, 'skipped': "数据不足"})
             else:
-                print(f"  未选中")
-                # 打印未选中的原因
-                ind = result['indicators']
-                reasons = []
-                if not ind.get('J_OK'): reasons.append(f"J>{13}")
-                if not ind.get('TRIGGER'): reasons.append("无触发信号")
-                if not ind.get('LQ'): reasons.append("流动性不足")
-                if not ind.get('MAX28_OK'): reasons.append("28日有天量阴线")
-                if not ind.get('YANGYIN_OK'): reasons.append("阴阳量不平衡")
-                if not ind.get('DIF>0'): reasons.append("MACD.DIF<=0")
-                if not ind.get('MVOK', True): reasons.append(f"市值{ind.get('MV', 0):.0f}亿<30亿")
-                if reasons:
-                    print(f"      原因: {', '.join(reasons)}")
+                _apply_mv_check(result, spot_dict)
+                results.append(result)
 
-        except Exception as e:
-            print(f"  错误: {e}")
-            failed_stocks.append(stock_code)
+        for i, result in enumerate(results, 1):
+            handle_result(i, result)
+    else:
+        # 各股票文件相互独立，用进程池并行读取+分析，在父进程中汇总
+        with mp.Pool(processes=os.cpu_count(),
+                     initializer=_init_worker, initargs=(spot_dict, results_cache)) as pool:
+            for i, result in enumerate(
+                    pool.imap_unordered(_process_one, data_files, chunksize=16), 1):
+                handle_result(i, result)
+
+    # 保存结果缓存，下次运行时未变化的文件直接跳过
+    try:
+        os.makedirs(os.path.dirname(results_cache_path), exist_ok=True)
+        with open(results_cache_path, 'w', encoding='utf-8') as f:
+            json.dump(results_cache, f, ensure_ascii=False)
+    except Exception as e:
+        print(f"保存结果缓存失败: {e}")
 
     # 输出结果
     print(f"\n{'=' * 60}")
     print(f"选股完成！")
-    print(f"分析股票总数: {len(excel_files)}")
+    print(f"分析股票总数: {len(data_files)}")
     print(f"选中股票数量: {len(selected_stocks)}")
     print(f"失败股票数量: {len(failed_stocks)}")
 
@@ -374,7 +933,9 @@ def run_stock_selection(data_dir="data", output_file="selected_stocks.xlsx"):
             results_data.append(row)
 
         result_df = pd.DataFrame(results_data)
-        result_df.to_excel(output_file, index=False, engine='openpyxl')
+        # xlsxwriter写小表比openpyxl快，constant_memory边写边刷不驻留整表
+        result_df.to_excel(output_file, index=False, engine='xlsxwriter',
+                           engine_kwargs={'options': {'constant_memory': True}})
         print(f"\n选股结果已保存至: {os.path.abspath(output_file)}")
         print("\n选中股票列表:")
         print(result_df.to_string())